@@ -1,9 +1,30 @@
 import streamlit as st
-import google.generativeai as genai
-import os
-from visual_business_model_canvas import show_bmc_visualization
-from io import BytesIO
-from docx import Document
+import json
+from html import escape
+from visual_business_model_canvas import show_bmc_visualization, listify
+from io import BytesIO, StringIO
+
+from bmc_core import (
+    STEPS,
+    Turn,
+    STEP_DEPENDENCIES,
+    FANOUT_SOURCES,
+    PROMPTS,
+    generate_step,
+    refine_step,
+    fan_out_step,
+    semantic_lookup,
+    semantic_store,
+    CONTEXT_CHAR_BUDGET,
+    compact_context,
+    SWOTEntry,
+    validate_step_output,
+    create_story_cache,
+    run_full_pipeline,
+    generate_canvas_from_swot,
+)
+from pydantic import ValidationError
+from session_store import current_sid, load_session, save_session
 
 # -------------------------------
 # Configure Gemini API
@@ -12,129 +33,80 @@ if "GEMINI_API_KEY" not in st.secrets:
     st.error("❌ Please add your Gemini API key in Streamlit Secrets.")
     st.stop()
 
-genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-model = genai.GenerativeModel("gemini-2.0-flash")
-
 # -------------------------------
-# Define workflow steps
+# SWOT dashboard helpers
 # -------------------------------
-STEPS = [
-    "Story Input",
-    "Focus Generation",
-    "Issues Generation",
-    "Tension Matrix",
-    "Dilemmas & Ranking",
-    "Value Propositions",
-    "SWOT Analysis",
-    "Business Model Canvas",
-    "Business Plan"
-]
+@st.cache_data(show_spinner=False)
+def parse_swot_json(text: str):
+    """Parse the SWOT response once per unique text (reruns hit the memo)."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            return None
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+
+def _swot_card(color, heading, items):
+    bullets = "".join(f"<li>{escape(i)}</li>" for i in listify(items))
+    return (
+        f'<div style="background-color:{color};border-radius:10px;padding:10px 16px;margin-bottom:8px;">'
+        f'<h5>{heading}</h5><ul style="margin-top:6px;">{bullets}</ul></div>'
+    )
+
+@st.cache_data(show_spinner=False)
+def swot_entry_html(entry_json: str) -> str:
+    """Memoized single-blob HTML for one SWOT entry (2x2 CSS grid) — one
+    st.markdown delta per entry instead of four."""
+    try:
+        entry = SWOTEntry.model_validate_json(entry_json)
+        s, w, o, t = entry.S, entry.W, entry.O, entry.T
+    except ValidationError:
+        # Legacy/partial entries restored from old sessions.
+        raw = json.loads(entry_json)
+        s, w, o, t = raw.get("S"), raw.get("W"), raw.get("O"), raw.get("T")
+    cards = (
+        _swot_card("#e6ffe6", "💪 Strengths", s)
+        + _swot_card("#f0f8ff", "🚀 Opportunities", o)
+        + _swot_card("#fff0f0", "⚠️ Weaknesses", w)
+        + _swot_card("#fff8e6", "💣 Threats", t)
+    )
+    return f'<div style="display:grid;grid-template-columns:repeat(2,1fr);gap:8px;">{cards}</div>'
+
+@st.cache_data(show_spinner=False)
+def build_docx(vp_title: str, body: str) -> bytes:
+    """Serialize the Business Plan docx once per (title, body) — reruns of the
+    final page reuse the bytes instead of rebuilding the XML tree."""
+    # Deferred: python-docx costs tens of ms to import and only the final
+    # step needs it, so earlier reruns skip the cost entirely.
+    from docx import Document
+
+    doc = Document()
+    doc.add_heading("Business Plan", level=1)
+    if vp_title:
+        doc.add_paragraph(f"Value Proposition: {vp_title}")
+    doc.add_paragraph(body)
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
 
 # -------------------------------
-# Predefined prompt templates
+# Conversation history helpers
 # -------------------------------
-PROMPTS = {
-    "Focus Generation": """You are given the user's story below. Apply the Dilemma Triangle methodology (People, Planet, Prosperity) to extract focus areas.
-For each driver, produce only 1 specific focus area and a short rationale saying that why it does not exclude any SDGs and clearly indicate which SDGs the focus addresses.(2–3 sentences).
-Return only valid JSON and nothing else:
-{
-  "focuses": [
-    {"driver":"People","focus":"...","rationale":"..."},
-    {"driver":"Planet","focus":"...","rationale":"..."},
-    {"driver":"Prosperity","focus":"...","rationale":"..."}
-  ]
-}""",
-
-    "Issues Generation": """Given the focus areas (and drivers), list 3–4 issues for each focus area that stem from it.
-Return only valid JSON and nothing else:
-{
-  "issues_by_focus": [
-    {"focus":"...","driver":"...","issues":[{"issue":"...","explain":"..."}]}
-  ]
-}""",
-
-    "Tension Matrix": """Given the issues across focuses, generate a tension matrix describing conflicts or tradeoffs between issues.
-Return only valid JSON and nothing else:
-{
-  "tensions":[
-    {"issue_a":"...","issue_b":"...","tension":"...","why":"..."}
-  ]
-}""",
-
-    "Dilemmas & Ranking": """From the tension matrix, generate dilemmas phrased as tradeoffs.
-Each dilemma should include a title, description, affected drivers, and an importance score (1–10).
-Return only valid JSON and nothing else:
-{
-  "dilemmas":[
-    {"title":"...","description":"...","drivers":["People","Planet"],"score":8}
-  ]
-}""",
-
-    "Value Propositions": """For the top dilemmas, propose only 2-3 concrete value propositions (solutions) addressing the dilemmas while balancing drivers.
-Return only valid JSON and nothing else:
-{
-  "value_propositions":[
-    {"title":"...","explain":"...","dilemmas":["..."],"benefits":["..."]}
-  ]
-}""",
-
-    "SWOT Analysis": """Perform a SWOT analysis on each provided value proposition.
-Return only valid JSON and nothing else:
-{
-  "swot":[
-    {"title":"...","S":["..."],"W":["..."],"O":["..."],"T":["..."]}
-  ]
-}""",
-
-    "Business Model Canvas": """Generate a Business Model Canvas (9 blocks) for the selected value proposition.
-Return only valid JSON and nothing else. Make sure to include all 9 blocks with the exact keys:
-- key_partners
-- key_activities
-- key_resources
-- value_propositions
-- customer_relationships
-- channels
-- customer_segments
-- revenue_streams
-- cost_structure
-
-JSON format example:
-{
-  "bmc":[
-    {
-      "value_proposition":"<Title of Value Proposition>",
-      "canvas":{
-        "key_partners":["..."],
-        "key_activities":["..."],
-        "key_resources":["..."],
-        "value_propositions":["..."],
-        "customer_relationships":["..."],
-        "channels":["..."],
-        "customer_segments":["..."],
-        "revenue_streams":["..."],
-        "cost_structure":["..."]
-      }
-    }
-  ]
-}""",
-
-    "Business Plan": """You are an expert business strategist.
-
-Using all the information provided below — including the original story, SWOT analysis, and the Business Model Canvas — create a clear and structured Business Plan (around 2–3 pages) that includes:
-
-1. Executive Summary
-2. Market Opportunity
-3. Business Model (connected to the BMC)
-4. Product or Service Description
-5. Marketing and Customer Strategy
-6. Operations Plan
-7. Financial and Sustainability Outlook
-8. Key Risks and Mitigation Strategies
-9. Conclusion and Next Steps
-
-Be concise yet insightful. Use bullet points or short paragraphs where suitable.
-Return the business plan in plain text (no JSON or markdown fences)."""
-}
+def _append_history(step, response):
+    """Append one step's block to the running history string (O(1) amortized)."""
+    block = f"### Step: {step}\n{response}"
+    existing = st.session_state.prev_outputs_str
+    st.session_state.prev_outputs_str = f"{existing}\n\n{block}" if existing else block
+
+def _rebuild_history():
+    """Recompute the running history string (only needed after a refine)."""
+    st.session_state.prev_outputs_str = "\n\n".join(
+        f"### Step: {c.step}\n{c.response}" for c in st.session_state.conversation
+    )
 
 # -------------------------------
 # Initialize session state
@@ -149,6 +121,34 @@ if "completed" not in st.session_state:
     st.session_state.completed = False
 if "selected_value_prop" not in st.session_state:
     st.session_state.selected_value_prop = None
+if "prev_outputs_str" not in st.session_state:
+    st.session_state.prev_outputs_str = ""
+if "story_cache" not in st.session_state:
+    st.session_state.story_cache = None
+
+# -------------------------------
+# Restore / persist the session
+# -------------------------------
+# Sessions are keyed by the sid query parameter and stored in SQLite, so a
+# page reload (or server restart) resumes where the user left off without
+# re-running any LLM step.
+sid = current_sid()
+if not st.session_state.conversation:
+    _saved = load_session(sid)
+    if _saved:
+        for _key, _value in _saved.items():
+            st.session_state[_key] = _value
+
+def _persist():
+    """Write the durable slice of session state to SQLite."""
+    save_session(sid, {
+        "conversation": st.session_state.conversation,
+        "step_index": st.session_state.step_index,
+        "story": st.session_state.story,
+        "completed": st.session_state.completed,
+        "selected_value_prop": st.session_state.selected_value_prop,
+        "prev_outputs_str": st.session_state.prev_outputs_str,
+    })
 
 # -------------------------------
 # Current step
@@ -167,16 +167,36 @@ else:
 # -------------------------------
 if current_step == "Story Input":
     user_story = st.text_area("✏️ Please provide the full story or context:", value=st.session_state.story, height=200)
+    auto_run = st.checkbox(
+        "Run all steps automatically",
+        help="Generate every step up to the Business Model Canvas in one Gemini call, then review and refine as usual.",
+    )
     if st.button("Submit Story"):
         if user_story.strip():
             st.session_state.story = user_story.strip()
-            st.session_state.conversation.append({
-                "step": "Story Input",
-                "prompt": user_story.strip(),
-                "response": "✅ Story saved successfully.",
-                "feedback": ""
-            })
+            # Park the story in a server-side Gemini context cache so later
+            # steps reference it by name instead of re-sending (and re-billing)
+            # the same prefix ~8 times. None means "too short to cache".
+            st.session_state.story_cache = create_story_cache(st.session_state.story)
+            st.session_state.conversation.append(
+                Turn("Story Input", user_story.strip(), "✅ Story saved successfully.")
+            )
+            _append_history("Story Input", "✅ Story saved successfully.")
             st.session_state.step_index += 1
+            if auto_run:
+                # One fused call replaces 7 serial round trips; the synthetic
+                # per-step entries feed the existing display/refine code.
+                with st.spinner("Running all steps automatically..."):
+                    results = run_full_pipeline(st.session_state.story, st.session_state.story_cache)
+                if results:
+                    for auto_step, auto_text in results:
+                        auto_text = validate_step_output(auto_step, auto_text)
+                        st.session_state.conversation.append(Turn(auto_step, PROMPTS.get(auto_step, ""), auto_text))
+                        _append_history(auto_step, auto_text)
+                    st.session_state.step_index = STEPS.index(results[-1][0])
+                else:
+                    st.warning("Automatic run failed — continuing step by step.")
+            _persist()
             st.success("Story submitted. Proceeding to Focus Generation.")
             st.rerun()
         else:
@@ -186,8 +206,27 @@ if current_step == "Story Input":
 # Step 2–8: LLM-driven steps
 # -------------------------------
 else:
-    if len(st.session_state.conversation) <= st.session_state.step_index:
-        prev_outputs = "\n\n".join([f"### Step: {c['step']}\n{c['response']}" for c in st.session_state.conversation])
+    # The in-flight token makes the generate-if-missing block idempotent: if a
+    # widget event reruns the script before st.rerun() lands, the second pass
+    # sees the token and skips instead of firing a duplicate Gemini call.
+    inflight_key = f"inflight_{current_step}"
+    if len(st.session_state.conversation) <= st.session_state.step_index and not st.session_state.get(inflight_key):
+        dependencies = STEP_DEPENDENCIES.get(current_step)
+        if dependencies is None:
+            # Full history: served from the incrementally maintained string
+            # instead of re-joining the whole conversation every rerun.
+            prev_outputs = st.session_state.prev_outputs_str
+            if len(prev_outputs) > CONTEXT_CHAR_BUDGET:
+                prev_outputs = compact_context([
+                    f"### Step: {c.step}\n{c.response}"
+                    for c in st.session_state.conversation
+                ])
+        else:
+            prev_outputs = compact_context([
+                f"### Step: {c.step}\n{c.response}"
+                for c in st.session_state.conversation
+                if c.step in dependencies
+            ])
         base_prompt = PROMPTS.get(current_step, "")
         story_context = st.session_state.story
 
@@ -195,107 +234,135 @@ else:
         if current_step == "Business Model Canvas" and st.session_state.selected_value_prop:
             selected_swot = st.session_state.selected_value_prop
             prev_outputs = f"### Selected SWOT\n{selected_swot}"
-            final_prompt = f"{base_prompt}\n\nContext:\n{story_context}\n\nSelected SWOT Value Proposition:\n{selected_swot}"
-        else:
-            final_prompt = f"{base_prompt}\n\nContext:\n{story_context}\n\nPrevious Outputs:\n{prev_outputs}"
-
-        with st.spinner(f"Generating {current_step}..."):
-            response = model.generate_content(final_prompt)
-            text_response = response.text if hasattr(response, "text") else "Error: No valid response."
-
-        st.session_state.conversation.append({
-            "step": current_step,
-            "prompt": final_prompt,
-            "response": text_response,
-            "feedback": ""
-        })
+        final_prompt = f"{base_prompt}\n\nContext:\n{story_context}\n\nPrevious Outputs:\n{prev_outputs}"
+
+        # Set immediately before the try so the finally always clears it —
+        # anything raising in between would otherwise leave the flag stuck
+        # and silently skip this step's generation for the whole session.
+        st.session_state[inflight_key] = True
+        try:
+            with st.spinner(f"Generating {current_step}..."):
+                # Near-duplicate stories (paraphrased resubmissions) are served
+                # from the semantic cache before any Gemini call is made; the
+                # prev_outputs hash in the key keeps hits honest when upstream
+                # steps or the SWOT selection differ.
+                text_response = semantic_lookup(current_step, story_context, prev_outputs)
+                generated = text_response is None
+                # Fan-out steps: one concurrent call per item instead of one giant prompt.
+                # The BMC step keeps its single call when a SWOT entry was selected.
+                if text_response is None and current_step in FANOUT_SOURCES and not (
+                    current_step == "Business Model Canvas" and st.session_state.selected_value_prop
+                ):
+                    text_response = fan_out_step(
+                        current_step, story_context, st.session_state.conversation,
+                        st.session_state.story_cache,
+                    )
+                # BMC with a selected SWOT entry: seed the decided canvas
+                # blocks client-side and only ask Gemini for the rest.
+                if text_response is None and current_step == "Business Model Canvas" and st.session_state.selected_value_prop:
+                    text_response = generate_canvas_from_swot(
+                        story_context, st.session_state.selected_value_prop,
+                        st.session_state.story_cache,
+                    )
+                if text_response is None:
+                    text_response = generate_step(
+                        current_step, story_context, prev_outputs,
+                        st.session_state.story_cache,
+                    )
+                if generated:
+                    # Repaired-if-needed text is what gets stored and rendered.
+                    text_response = validate_step_output(current_step, text_response)
+                    semantic_store(current_step, story_context, prev_outputs, text_response)
+
+            st.session_state.conversation.append(Turn(current_step, final_prompt, text_response))
+            _append_history(current_step, text_response)
+            _persist()
+        finally:
+            st.session_state[inflight_key] = False
         st.success(f"✅ {current_step} generated successfully.")
-        st.rerun()
 
-    # Display conversation history
-    for idx, item in enumerate(st.session_state.conversation):
-        st.markdown(f"### {idx + 1}. {item['step']}")
-        if item['step'] == "Story Input":
-            st.info(f"📖 Story: {item['prompt']}")
+    # Display conversation history. Each step is rendered inside a fragment
+    # so interacting with one step (typing feedback, clicking Refine) only
+    # reruns that step's UI instead of rebuilding every past expander.
+    @st.fragment
+    def render_step(idx, item):
+        st.markdown(f"### {idx + 1}. {item.step}")
+        if item.step == "Story Input":
+            st.info(f"📖 Story: {item.prompt}")
         else:
             st.markdown(f"**🤖 LLM Output:**")
             with st.expander("View Output"):
-                st.write(item['response'])
+                st.write(item.response)
 
         if idx == st.session_state.step_index:
             # Skip feedback/refine/approve for Business Plan step
-            if item["step"] == "Business Plan":
-                continue
+            if item.step == "Business Plan":
+                return
             feedback_key = f"feedback_{idx}"
             if feedback_key not in st.session_state:
-                st.session_state[feedback_key] = item.get("feedback", "")
+                st.session_state[feedback_key] = item.feedback
 
             feedback_text = st.text_input(
-                f"Provide feedback for {item['step']}",
+                f"Provide feedback for {item.step}",
                 value=st.session_state[feedback_key],
                 key=feedback_key + "_input"
             )
 
             col1, col2 = st.columns(2)
             with col1:
-                if st.button(f"🔄 Refine {item['step']}", key=f"refine_{idx}"):
+                if st.button(f"🔄 Refine {item.step}", key=f"refine_{idx}"):
 
                     if feedback_text.strip():
                         with st.spinner("Refining response..."):
-                            refine_prompt = (
-                                f"Refine the following output based on this feedback. Follow EXACTLY the same structure, format, and JSON schema and DO NOT change the response structure. \n\n"
-                                f"Feedback:\n{feedback_text}\n\nOriginal Output:\n{item['response']}"
-                            )
-                            refined = model.generate_content(refine_prompt)
-                            refined_text = refined.text if hasattr(refined, "text") else "Error: No refined response."
-                            st.session_state.conversation[idx]["response"] = refined_text
-                            st.session_state.conversation[idx]["feedback"] = feedback_text
+                            refined_text = refine_step(item.response, feedback_text)
+                            st.session_state.conversation[idx].response = refined_text
+                            st.session_state.conversation[idx].feedback = feedback_text
+                            _rebuild_history()
+                            _persist()
                         st.success("✅ Response refined successfully.")
                         st.rerun()
                     else:
                         st.warning("Please enter feedback before refining.")
 
-            with col2:
-                if st.button(f"✅ Approve {item['step']}", key=f"approve_{idx}"):
+            def _approve():
+                # Runs before the next script pass, so the advanced step index
+                # is already in place when the generation block executes — no
+                # intermediate frame with stale state gets rendered.
+                if st.session_state.step_index < len(STEPS) - 1:
+                    st.session_state.step_index += 1
+                else:
+                    st.session_state.completed = True
+                _persist()
 
-                    if st.session_state.step_index < len(STEPS) - 1:
-                        st.session_state.step_index += 1
-                        st.success(f"Step {idx + 1} approved. Moving to next step: {STEPS[st.session_state.step_index]}")
-                        st.rerun()
-                    else:
-                        st.session_state.completed = True
-                        st.success("🎉 All steps completed!")
-                        st.rerun()
+            with col2:
+                if st.button(f"✅ Approve {item.step}", key=f"approve_{idx}", on_click=_approve):
+                    # One app-scoped rerun: a button click inside a fragment
+                    # only reruns the fragment, and the next step's generation
+                    # block lives outside it.
+                    st.rerun(scope="app")
 
         else:
             st.caption("✅ Step completed")
 
+    for idx, item in enumerate(st.session_state.conversation):
+        render_step(idx, item)
+
 # -------------------------------
 # SWOT Analysis Visualization + Selection
 # -------------------------------
-if current_step == "SWOT Analysis" and len(st.session_state.conversation) > 0:
+# A fragment: typing in the feedback box (or any other widget elsewhere on
+# the page) no longer reruns the dashboard — only its own selectbox does.
+@st.fragment
+def swot_dashboard(last_output):
     st.markdown("---")
     st.subheader("🧠 SWOT Analysis Dashboard")
 
-    import json, re
-
-    def listify(value):
-        """Convert string or list into bullet list."""
-        if isinstance(value, list):
-            return value
-        elif isinstance(value, str):
-            return [v.strip("-• ") for v in re.split(r"[\n,;]", value) if v.strip()]
-        return []
-
     try:
-        last_output = st.session_state.conversation[-1]["response"]
-        match = re.search(r"(\{(?:.|\n)*\})", last_output)
-        json_str = match.group(1) if match else None
+        data = parse_swot_json(last_output)
 
-        if not json_str:
+        if data is None:
             st.warning("⚠️ No JSON object found in SWOT output.")
         else:
-            data = json.loads(json_str)
             if "swot" in data and isinstance(data["swot"], list):
             
                 # ---- Allow user to select one SWOT to continue ----
@@ -311,71 +378,27 @@ if current_step == "SWOT Analysis" and len(st.session_state.conversation) > 0:
                 for entry in data["swot"]:
                     st.markdown(f"## 🌿 {entry.get('title', 'Untitled Initiative')}")
 
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        # Strengths
-                        st.markdown(
-                            """
-                            <div style="background-color:#e6ffe6;border-radius:10px;padding:10px 16px;margin-bottom:8px;">
-                                <h5>💪 Strengths</h5>
-                                <ul style="margin-top:6px;">
-                            """ +
-                            "".join([f"<li>{s}</li>" for s in listify(entry.get("S"))]) +
-                            "</ul></div>",
-                            unsafe_allow_html=True,
-                        )
-
-                        # Weaknesses
-                        st.markdown(
-                            """
-                            <div style="background-color:#fff0f0;border-radius:10px;padding:10px 16px;margin-bottom:8px;">
-                                <h5>⚠️ Weaknesses</h5>
-                                <ul style="margin-top:6px;">
-                            """ +
-                            "".join([f"<li>{w}</li>" for w in listify(entry.get("W"))]) +
-                            "</ul></div>",
-                            unsafe_allow_html=True,
-                        )
-
-                    with col2:
-                        # Opportunities
-                        st.markdown(
-                            """
-                            <div style="background-color:#f0f8ff;border-radius:10px;padding:10px 16px;margin-bottom:8px;">
-                                <h5>🚀 Opportunities</h5>
-                                <ul style="margin-top:6px;">
-                            """ +
-                            "".join([f"<li>{o}</li>" for o in listify(entry.get("O"))]) +
-                            "</ul></div>",
-                            unsafe_allow_html=True,
-                        )
-
-                        # Threats
-                        st.markdown(
-                            """
-                            <div style="background-color:#fff8e6;border-radius:10px;padding:10px 16px;margin-bottom:8px;">
-                                <h5>💣 Threats</h5>
-                                <ul style="margin-top:6px;">
-                            """ +
-                            "".join([f"<li>{t}</li>" for t in listify(entry.get("T"))]) +
-                            "</ul></div>",
-                            unsafe_allow_html=True,
-                        )
+                    st.markdown(swot_entry_html(json.dumps(entry, sort_keys=True)), unsafe_allow_html=True)
 
                     st.markdown("---")
 
             else:
                 st.info("No valid SWOT data found in output.")
-    except json.JSONDecodeError as e:
-        st.error(f"❌ Could not parse SWOT JSON: {e}")
     except Exception as e:
         st.error(f"⚠️ Error displaying SWOT Analysis: {e}")
 
+if current_step == "SWOT Analysis" and len(st.session_state.conversation) > 0:
+    swot_dashboard(st.session_state.conversation[-1].response)
+
 # -------------------------------
 # Business Model Canvas Visualization
 # -------------------------------
+@st.fragment
+def bmc_dashboard(last_output):
+    show_bmc_visualization(last_output)
+
 if current_step == "Business Model Canvas" and len(st.session_state.conversation) > 0:
-    show_bmc_visualization(st.session_state.conversation[-1]["response"])
+    bmc_dashboard(st.session_state.conversation[-1].response)
 
 # -------------------------------
 # Business Plan (view + download only)
@@ -390,26 +413,17 @@ elif current_step == "Business Plan":
 
     # Get the generated Business Plan text from the conversation
     if len(st.session_state.conversation) > 0:
-        st.session_state.business_plan = st.session_state.conversation[-1]["response"]
+        st.session_state.business_plan = st.session_state.conversation[-1].response
 
         # Display note and download option
         st.success("✅ Business Plan generated successfully!")
-        # Create Word document
-        doc = Document()
-        doc.add_heading("Business Plan", level=1)
+        doc_vp_title = ""
         if "selected_value_prop" in st.session_state and st.session_state.selected_value_prop:
-            doc.add_paragraph(f"Value Proposition: {st.session_state.selected_value_prop.get('title','')}")
-
-        doc.add_paragraph(st.session_state.business_plan)
-
-        # Convert to bytes for download
-        buffer = BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
+            doc_vp_title = st.session_state.selected_value_prop.get("title", "")
 
         st.download_button(
             "⬇️ Download Business Plan (Word)",
-            data=buffer,
+            data=build_docx(doc_vp_title, st.session_state.business_plan),
             file_name="Business_Plan.docx",
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
@@ -417,3 +431,23 @@ elif current_step == "Business Plan":
     else:
         st.warning("⚠️ No Business Plan found. Please complete the previous steps first.")
 
+# -------------------------------
+# Full report export
+# -------------------------------
+# The report is assembled once into an in-memory buffer and streamed to the
+# browser via st.download_button — no local disk I/O (which would also break
+# on Streamlit Cloud where there is no writable home directory to speak of).
+if st.session_state.conversation:
+    st.markdown("---")
+    report = StringIO()
+    for c in st.session_state.conversation:
+        report.write(f"## {c.step}\n### Prompt:\n{c.prompt}\n\n### Response:\n{c.response}\n\n")
+        if c.feedback:
+            report.write(f"### Feedback:\n{c.feedback}\n\n")
+    st.download_button(
+        "💾 Download Final Report",
+        data=report.getvalue(),
+        file_name="BMC_Full_Report.txt",
+        mime="text/plain"
+    )
+
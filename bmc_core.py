@@ -0,0 +1,786 @@
+# bmc_core.py
+# Workflow engine for the Business Plan Dashboard: step definitions, prompt
+# templates, Gemini response schemas and the (cached) LLM call helpers.
+# app.py stays a thin Streamlit UI shell on top of this module.
+import streamlit as st
+import google.generativeai as genai
+from google.generativeai.types import GenerationConfig
+import datetime
+import hashlib
+import json
+import random
+import threading
+import time
+import numpy as np
+from google.api_core import exceptions as api_exceptions
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from string import Template
+from pydantic import BaseModel, ValidationError
+from session_store import load_semantic_rows, add_semantic_row
+
+@dataclass(slots=True)
+class Turn:
+    """One conversation entry; slots keep per-turn overhead to a few pointers
+    instead of a full per-entry dict."""
+    step: str
+    prompt: str
+    response: str
+    feedback: str = ""
+
+# -------------------------------
+# Gemini client
+# -------------------------------
+@st.cache_resource
+def get_model():
+    """Create the Gemini client once per process and reuse it across reruns."""
+    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+    return genai.GenerativeModel("gemini-2.0-flash")
+
+# Transient statuses worth retrying: rate limits (429) and server-side 5xx.
+_RETRYABLE = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+)
+_MAX_ATTEMPTS = 5
+
+def _with_retries(call):
+    """Run a Gemini call, retrying transient errors with jittered exponential
+    backoff (1s, 2s, 4s, 8s + jitter) instead of surfacing them to the page
+    and forcing the user to re-click."""
+    for attempt in range(_MAX_ATTEMPTS):
+        try:
+            return call()
+        except _RETRYABLE:
+            if attempt == _MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(min(30, 2 ** attempt) + random.uniform(0, 1))
+
+def create_story_cache(story: str):
+    """Create an explicit Gemini context cache holding the story prefix.
+
+    Returns the cache name, or None when the API refuses (e.g. the story is
+    below the minimum cacheable token count) — callers then fall back to
+    sending the raw text with every request.
+    """
+    get_model()  # ensure genai.configure has run
+    try:
+        cache = genai.caching.CachedContent.create(
+            model="models/gemini-2.0-flash",
+            contents=[story],
+            ttl=datetime.timedelta(minutes=30),
+        )
+        return cache.name
+    except Exception:
+        return None
+
+@st.cache_resource(show_spinner=False)
+def _cached_content_model(cache_name: str):
+    """Model bound to a server-side context cache, built once per cache."""
+    cached = genai.caching.CachedContent.get(cache_name)
+    return genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+_CACHED_STORY_NOTE = "(story provided via cached context)"
+
+def _drop_cached_content_model(cache_name: str):
+    """Evict a model bound to a dead server-side cache so later callers
+    rebuild instead of reusing the stale singleton."""
+    try:
+        _cached_content_model.clear(cache_name)
+    except Exception:
+        pass
+
+def _generate_with_story(story, cache_name, build_prompt, config=None):
+    """Run a non-streaming Gemini call, preferring the server-side story cache.
+
+    build_prompt(story_text) produces the prompt. If the cached-content path
+    fails end to end — typically because the 30-minute CachedContent TTL
+    lapsed while the user was reviewing a step — the stale model is evicted
+    and the call is redone against the plain client with the raw story.
+    """
+    if cache_name:
+        try:
+            model = _cached_content_model(cache_name)
+            return _with_retries(
+                lambda: model.generate_content(build_prompt(_CACHED_STORY_NOTE), generation_config=config)
+            )
+        except Exception:
+            _drop_cached_content_model(cache_name)
+    return _with_retries(lambda: get_model().generate_content(build_prompt(story), generation_config=config))
+
+# -------------------------------
+# Define workflow steps
+# -------------------------------
+STEPS = [
+    "Story Input",
+    "Focus Generation",
+    "Issues Generation",
+    "Tension Matrix",
+    "Dilemmas & Ranking",
+    "Value Propositions",
+    "SWOT Analysis",
+    "Business Model Canvas",
+    "Business Plan"
+]
+
+# -------------------------------
+# Predefined prompt templates
+# -------------------------------
+PROMPTS = {
+    "Focus Generation": """You are given the user's story below. Apply the Dilemma Triangle methodology (People, Planet, Prosperity) to extract focus areas.
+For each driver, produce only 1 specific focus area and a short rationale saying that why it does not exclude any SDGs and clearly indicate which SDGs the focus addresses.(2–3 sentences).
+Use this JSON structure:
+{
+  "focuses": [
+    {"driver":"People","focus":"...","rationale":"..."},
+    {"driver":"Planet","focus":"...","rationale":"..."},
+    {"driver":"Prosperity","focus":"...","rationale":"..."}
+  ]
+}""",
+
+    "Issues Generation": """Given the focus areas (and drivers), list 3–4 issues for each focus area that stem from it.
+Use this JSON structure:
+{
+  "issues_by_focus": [
+    {"focus":"...","driver":"...","issues":[{"issue":"...","explain":"..."}]}
+  ]
+}""",
+
+    "Tension Matrix": """Given the issues across focuses, generate a tension matrix describing conflicts or tradeoffs between issues.
+Use this JSON structure:
+{
+  "tensions":[
+    {"issue_a":"...","issue_b":"...","tension":"...","why":"..."}
+  ]
+}""",
+
+    "Dilemmas & Ranking": """From the tension matrix, generate dilemmas phrased as tradeoffs.
+Each dilemma should include a title, description, affected drivers, and an importance score (1–10).
+Use this JSON structure:
+{
+  "dilemmas":[
+    {"title":"...","description":"...","drivers":["People","Planet"],"score":8}
+  ]
+}""",
+
+    "Value Propositions": """For the top dilemmas, propose only 2-3 concrete value propositions (solutions) addressing the dilemmas while balancing drivers.
+Use this JSON structure:
+{
+  "value_propositions":[
+    {"title":"...","explain":"...","dilemmas":["..."],"benefits":["..."]}
+  ]
+}""",
+
+    "SWOT Analysis": """Perform a SWOT analysis on each provided value proposition.
+Use this JSON structure:
+{
+  "swot":[
+    {"title":"...","S":["..."],"W":["..."],"O":["..."],"T":["..."]}
+  ]
+}""",
+
+    "Business Model Canvas": """Generate a Business Model Canvas (9 blocks) for the selected value proposition.
+Make sure to include all 9 blocks with the exact keys:
+- key_partners
+- key_activities
+- key_resources
+- value_propositions
+- customer_relationships
+- channels
+- customer_segments
+- revenue_streams
+- cost_structure
+
+JSON format example:
+{
+  "bmc":[
+    {
+      "value_proposition":"<Title of Value Proposition>",
+      "canvas":{
+        "key_partners":["..."],
+        "key_activities":["..."],
+        "key_resources":["..."],
+        "value_propositions":["..."],
+        "customer_relationships":["..."],
+        "channels":["..."],
+        "customer_segments":["..."],
+        "revenue_streams":["..."],
+        "cost_structure":["..."]
+      }
+    }
+  ]
+}""",
+
+    "Business Plan": """You are an expert business strategist.
+
+Using all the information provided below — including the original story, SWOT analysis, and the Business Model Canvas — create a clear and structured Business Plan (around 2–3 pages) that includes:
+
+1. Executive Summary
+2. Market Opportunity
+3. Business Model (connected to the BMC)
+4. Product or Service Description
+5. Marketing and Customer Strategy
+6. Operations Plan
+7. Financial and Sustainability Outlook
+8. Key Risks and Mitigation Strategies
+9. Conclusion and Next Steps
+
+Be concise yet insightful. Use bullet points or short paragraphs where suitable.
+Return the business plan in plain text (no JSON or markdown fences)."""
+}
+
+# Full per-step prompt templates, compiled once at import time so building a
+# prompt is a single substitution call instead of repeated f-string assembly.
+_PROMPT_TMPL = {
+    step: Template(text + "\n\nContext:\n$story\n\nPrevious Outputs:\n$prev")
+    for step, text in PROMPTS.items()
+}
+
+# -------------------------------
+# Per-item prompts for fan-out steps
+# -------------------------------
+# These steps expand over a list of independent items (focus areas or value
+# propositions), so each item can be generated in its own Gemini call and the
+# calls dispatched concurrently instead of one giant serial prompt.
+FANOUT_PROMPTS = {
+    "Issues Generation": """Given the single focus area (and driver) below, list 3–4 issues that stem from it.
+Use this JSON structure:
+{"focus":"...","driver":"...","issues":[{"issue":"...","explain":"..."}]}""",
+
+    "SWOT Analysis": """Perform a SWOT analysis on the single value proposition below.
+Use this JSON structure:
+{"title":"...","S":["..."],"W":["..."],"O":["..."],"T":["..."]}""",
+
+    "Business Model Canvas": """Generate a Business Model Canvas (9 blocks) for the single value proposition below.
+Make sure to include all 9 blocks with the exact keys:
+{
+  "value_proposition":"<Title of Value Proposition>",
+  "canvas":{
+    "key_partners":["..."],
+    "key_activities":["..."],
+    "key_resources":["..."],
+    "value_propositions":["..."],
+    "customer_relationships":["..."],
+    "channels":["..."],
+    "customer_segments":["..."],
+    "revenue_streams":["..."],
+    "cost_structure":["..."]
+  }
+}""",
+}
+
+# -------------------------------
+# Response schemas (Gemini JSON mode)
+# -------------------------------
+# Every JSON step constrains the model with a response schema, so the output
+# is guaranteed to be valid JSON in the exact shape the renderers expect —
+# no regex extraction or failed-parse retries needed.
+_STR = {"type": "string"}
+_STR_LIST = {"type": "array", "items": {"type": "string"}}
+
+def _obj(props):
+    return {"type": "object", "properties": props, "required": list(props)}
+
+def _arr(items):
+    return {"type": "array", "items": items}
+
+_CANVAS_SCHEMA = _obj({
+    "key_partners": _STR_LIST,
+    "key_activities": _STR_LIST,
+    "key_resources": _STR_LIST,
+    "value_propositions": _STR_LIST,
+    "customer_relationships": _STR_LIST,
+    "channels": _STR_LIST,
+    "customer_segments": _STR_LIST,
+    "revenue_streams": _STR_LIST,
+    "cost_structure": _STR_LIST,
+})
+
+RESPONSE_SCHEMAS = {
+    "Focus Generation": _obj({"focuses": _arr(_obj({"driver": _STR, "focus": _STR, "rationale": _STR}))}),
+    "Issues Generation": _obj({"issues_by_focus": _arr(_obj({
+        "focus": _STR, "driver": _STR,
+        "issues": _arr(_obj({"issue": _STR, "explain": _STR})),
+    }))}),
+    "Tension Matrix": _obj({"tensions": _arr(_obj({"issue_a": _STR, "issue_b": _STR, "tension": _STR, "why": _STR}))}),
+    "Dilemmas & Ranking": _obj({"dilemmas": _arr(_obj({
+        "title": _STR, "description": _STR, "drivers": _STR_LIST, "score": {"type": "integer"},
+    }))}),
+    "Value Propositions": _obj({"value_propositions": _arr(_obj({
+        "title": _STR, "explain": _STR, "dilemmas": _STR_LIST, "benefits": _STR_LIST,
+    }))}),
+    "SWOT Analysis": _obj({"swot": _arr(_obj({
+        "title": _STR, "S": _STR_LIST, "W": _STR_LIST, "O": _STR_LIST, "T": _STR_LIST,
+    }))}),
+    "Business Model Canvas": _obj({"bmc": _arr(_obj({"value_proposition": _STR, "canvas": _CANVAS_SCHEMA}))}),
+}
+
+# Per-item schemas for the fan-out prompts above.
+FANOUT_SCHEMAS = {
+    "Issues Generation": _obj({
+        "focus": _STR, "driver": _STR,
+        "issues": _arr(_obj({"issue": _STR, "explain": _STR})),
+    }),
+    "SWOT Analysis": _obj({"title": _STR, "S": _STR_LIST, "W": _STR_LIST, "O": _STR_LIST, "T": _STR_LIST}),
+    "Business Model Canvas": _obj({"value_proposition": _STR, "canvas": _CANVAS_SCHEMA}),
+}
+
+# Built once at import time; "Business Plan" is plain text so it has no config.
+GENERATION_CONFIGS = {
+    step: GenerationConfig(response_mime_type="application/json", response_schema=schema)
+    for step, schema in RESPONSE_SCHEMAS.items()
+}
+FANOUT_CONFIGS = {
+    step: GenerationConfig(response_mime_type="application/json", response_schema=schema)
+    for step, schema in FANOUT_SCHEMAS.items()
+}
+
+# -------------------------------
+# Auto-run pipeline
+# -------------------------------
+# The structured steps fused into one application-centric request: a single
+# Gemini call emits every stage's key in one JSON envelope, trading 7 network
+# round trips for 1. Dict order is the workflow order.
+PIPELINE_STEP_KEYS = {
+    "Focus Generation": "focuses",
+    "Issues Generation": "issues_by_focus",
+    "Tension Matrix": "tensions",
+    "Dilemmas & Ranking": "dilemmas",
+    "Value Propositions": "value_propositions",
+    "SWOT Analysis": "swot",
+    "Business Model Canvas": "bmc",
+}
+PIPELINE_SCHEMA = _obj({
+    key: RESPONSE_SCHEMAS[step]["properties"][key]
+    for step, key in PIPELINE_STEP_KEYS.items()
+})
+PIPELINE_CONFIG = GenerationConfig(response_mime_type="application/json", response_schema=PIPELINE_SCHEMA)
+_CANVAS_CONFIG = GenerationConfig(response_mime_type="application/json", response_schema=_CANVAS_SCHEMA)
+PIPELINE_PROMPT = (
+    "Run the full workflow below on the story in one pass. Work through the "
+    "stages in order, feeding each stage's output into the next, and return "
+    "ONE JSON object containing all of the listed keys.\n\n"
+    + "\n\n".join(f'## {step} -> "{key}"\n{PROMPTS[step]}' for step, key in PIPELINE_STEP_KEYS.items())
+)
+
+# -------------------------------
+# Context needed by each step
+# -------------------------------
+# Each step only needs the output of the step(s) it structurally builds on,
+# so only those are fed back as "Previous Outputs" — sending the whole
+# transcript would grow the prompt (and Gemini cost/latency) quadratically
+# over the workflow.
+STEP_DEPENDENCIES = {
+    "Issues Generation": ["Focus Generation"],
+    "Tension Matrix": ["Issues Generation"],
+    "Dilemmas & Ranking": ["Tension Matrix"],
+    "Value Propositions": ["Dilemmas & Ranking"],
+    "SWOT Analysis": ["Value Propositions"],
+    "Business Model Canvas": ["Value Propositions"],
+    "Business Plan": ["SWOT Analysis", "Business Model Canvas"],
+}
+
+# (previous step to pull items from, key holding the item list, key wrapping the merged result)
+FANOUT_SOURCES = {
+    "Issues Generation": ("Focus Generation", "focuses", "issues_by_focus"),
+    "SWOT Analysis": ("Value Propositions", "value_propositions", "swot"),
+    "Business Model Canvas": ("Value Propositions", "value_propositions", "bmc"),
+}
+
+# -------------------------------
+# Output validation & repair
+# -------------------------------
+# Pydantic mirrors of the SWOT/BMC response schemas. Validating right after
+# generation catches truncated or mis-keyed JSON before it reaches the render
+# path, and one automatic repair call replaces the manual Refine round-trip.
+class SWOTEntry(BaseModel):
+    title: str
+    S: list[str]
+    W: list[str]
+    O: list[str]
+    T: list[str]
+    recommendation: str | None = None
+
+class SWOTReport(BaseModel):
+    swot: list[SWOTEntry]
+
+class BMCEntry(BaseModel):
+    value_proposition: str
+    canvas: dict[str, list[str]]
+
+class BMCReport(BaseModel):
+    bmc: list[BMCEntry]
+
+_REPORT_MODELS = {
+    "SWOT Analysis": SWOTReport,
+    "Business Model Canvas": BMCReport,
+}
+
+# Sentinels the generation/refine helpers return when Gemini yields no usable
+# text — these are failure markers, not model output.
+_ERROR_SENTINELS = ("Error: No valid response.", "Error: No refined response.")
+
+def _is_generation_error(text: str) -> bool:
+    return text in _ERROR_SENTINELS
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=64)
+def _repair_json(step_name: str, raw: str, error: str) -> str:
+    """One-shot repair: hand Gemini the broken JSON plus the validation error
+    and ask for a corrected document (the step's JSON-mode config applies)."""
+    prompt = (
+        "The following JSON does not match the expected schema.\n"
+        f"Validation error:\n{error}\n\nJSON:\n{raw}\n\n"
+        "Return the corrected JSON only."
+    )
+    response = _with_retries(
+        lambda: get_model().generate_content(prompt, generation_config=GENERATION_CONFIGS.get(step_name))
+    )
+    try:
+        return response.text
+    except ValueError:
+        return raw
+
+def validate_step_output(step_name: str, text: str) -> str:
+    """Validate a step response against its report model; on failure issue one
+    repair call and re-validate. Returns the best available text."""
+    report_model = _REPORT_MODELS.get(step_name)
+    if report_model is None:
+        return text
+    if _is_generation_error(text):
+        # A hard failure must stay visible — handing the sentinel to the
+        # schema-forcing repair call would make Gemini fabricate a valid-
+        # looking report out of nothing.
+        return text
+    try:
+        report_model.model_validate_json(text)
+        return text
+    except ValidationError as err:
+        repaired = _repair_json(step_name, text, str(err))
+    try:
+        report_model.model_validate_json(repaired)
+        return repaired
+    except ValidationError:
+        return text
+
+# -------------------------------
+# Context compaction
+# -------------------------------
+# Even with STEP_DEPENDENCIES the "Previous Outputs" section can grow large
+# (long stories, many value propositions). Past this budget (~3k tokens) all
+# but the last two step blocks are replaced by a one-shot, cached Gemini
+# summary so per-step input tokens stay bounded.
+CONTEXT_CHAR_BUDGET = 12000
+CONTEXT_TOKEN_BUDGET = 3000
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=256)
+def tok_count(text: str) -> int:
+    """Exact token count via the API, falling back to a chars/4 estimate."""
+    try:
+        return _with_retries(lambda: get_model().count_tokens(text)).total_tokens
+    except Exception:
+        return len(text) // 4
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=64)
+def summarize_context(text: str) -> str:
+    """Compress earlier step outputs into a short summary (cached per text)."""
+    prompt = (
+        "Summarize the following workflow outputs in at most 500 tokens, "
+        "keeping every title, driver and key figure:\n\n" + text
+    )
+    response = _with_retries(lambda: get_model().generate_content(prompt))
+    try:
+        return response.text
+    except Exception:
+        return text[:CONTEXT_CHAR_BUDGET]
+
+def compact_context(blocks):
+    """Join step blocks, summarizing all but the last two when over budget.
+
+    The char budget is the cheap pre-filter; contexts past it are measured
+    exactly with count_tokens (cached) so borderline ones — e.g. CJK text or
+    dense JSON where chars/token varies — are not summarized needlessly.
+    """
+    joined = "\n\n".join(blocks)
+    if len(joined) <= CONTEXT_CHAR_BUDGET or len(blocks) <= 2:
+        return joined
+    if tok_count(joined) <= CONTEXT_TOKEN_BUDGET:
+        return joined
+    summary = summarize_context("\n\n".join(blocks[:-2]))
+    return "\n\n".join([f"### Summary of earlier steps\n{summary}"] + blocks[-2:])
+
+# -------------------------------
+# Semantic response cache
+# -------------------------------
+# Exact-match caching misses when the user rewords the same story; the
+# semantic cache reuses a step's response when a previous story embeds close
+# enough (cosine similarity above the threshold). Embeddings are L2-normalized
+# float32 vectors, so a lookup is one numpy dot product. Rows live in the
+# SQLite store so they outlive the browser session — the paraphrased
+# resubmission this exists for typically happens on a later visit.
+#
+# The story is only part of a step's input: prev_outputs (and, on the BMC
+# step, the selected SWOT entry it embeds) steer the result just as much, so
+# rows are additionally keyed on an exact hash of that context. A refinement
+# upstream or a different VP selection changes the hash and misses, instead
+# of serving a stale response under the new inputs.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+_EMBED_MODEL = "models/text-embedding-004"
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=256)
+def _embed(text: str):
+    """Normalized embedding for text, or None if the embedding call fails."""
+    try:
+        embedding = _with_retries(lambda: genai.embed_content(model=_EMBED_MODEL, content=text))["embedding"]
+    except Exception:
+        return None
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+def _context_key(context: str) -> str:
+    """Exact-match key for a step's non-story inputs."""
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+def semantic_lookup(step_name: str, story: str, context: str):
+    """Return a stored response for a semantically similar story generated
+    under the exact same non-story context, or None."""
+    candidates = load_semantic_rows(step_name, _context_key(context))
+    if not candidates:
+        return None
+    query = _embed(story)
+    if query is None:
+        return None
+    sims = np.stack([vector for vector, _ in candidates]) @ query
+    best = int(sims.argmax())
+    return candidates[best][1] if sims[best] > SEMANTIC_CACHE_THRESHOLD else None
+
+def semantic_store(step_name: str, story: str, context: str, response: str):
+    """Remember a (story embedding, context key, response) row for future
+    lookups. Failure sentinels are never stored — a persisted error would be
+    replayed to later sessions as a \"successful\" step."""
+    if _is_generation_error(response):
+        return
+    vector = _embed(story)
+    if vector is None:
+        return
+    add_semantic_row(step_name, _context_key(context), vector, response)
+
+# Per-request locks so concurrent identical generations (two tabs on the same
+# session, two users on the same demo story) coalesce into one Gemini call:
+# the first caller populates the cache and the others wait for it.
+_locks: dict = {}
+_locks_guard = threading.Lock()
+
+def generate_step(step_name: str, story: str, prev_outputs: str, cache_name: str = None) -> str:
+    """Run one workflow step through Gemini, coalescing duplicate callers."""
+    key = (step_name, hash(story), hash(prev_outputs))
+    with _locks_guard:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        return _cached_generate_step(step_name, story, prev_outputs, cache_name)
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=256)
+def _cached_generate_step(step_name: str, story: str, prev_outputs: str, cache_name: str = None) -> str:
+    """Run one workflow step through Gemini; identical inputs hit the cache.
+
+    The response is streamed into the page as it arrives, so the user sees
+    tokens at first-token latency instead of staring at a spinner for the
+    whole generation. When a server-side context cache holds the story, the
+    prompt references it instead of re-sending the raw text; if that cache
+    has expired mid-workflow, the stale model is evicted and the call is
+    redone with the raw story.
+    """
+    def run(model, story_text):
+        prompt = _PROMPT_TMPL[step_name].substitute(story=story_text, prev=prev_outputs)
+        stream = _with_retries(
+            lambda: model.generate_content(prompt, stream=True, generation_config=GENERATION_CONFIGS.get(step_name))
+        )
+        chunks = []
+
+        def token_gen():
+            for chunk in stream:
+                chunks.append(chunk.text)
+                yield chunk.text
+
+        try:
+            st.write_stream(token_gen())
+        except Exception:
+            if not chunks:
+                return None
+        return "".join(chunks)
+
+    if cache_name:
+        try:
+            result = run(_cached_content_model(cache_name), _CACHED_STORY_NOTE)
+        except Exception:
+            result = None
+        if result is not None:
+            return result
+        _drop_cached_content_model(cache_name)
+    result = run(get_model(), story)
+    return result if result is not None else "Error: No valid response."
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=256)
+def refine_step(original: str, feedback: str) -> str:
+    """Refine a step output based on user feedback; cached per (output, feedback).
+
+    Streams the refined text into the page as it arrives, like generation.
+    """
+    prompt = (
+        f"Refine the following output based on this feedback. Follow EXACTLY the same structure, format, and JSON schema and DO NOT change the response structure. \n\n"
+        f"Feedback:\n{feedback}\n\nOriginal Output:\n{original}"
+    )
+    stream = _with_retries(lambda: get_model().generate_content(prompt, stream=True))
+    chunks = []
+
+    def token_gen():
+        for chunk in stream:
+            chunks.append(chunk.text)
+            yield chunk.text
+
+    try:
+        st.write_stream(token_gen())
+    except Exception:
+        if not chunks:
+            return "Error: No refined response."
+    return "".join(chunks)
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=256)
+def generate_item(step_name: str, story: str, item_json: str, cache_name: str = None) -> str:
+    """Run one fan-out item through Gemini; cached so repeated items short-circuit."""
+    response = _generate_with_story(
+        story, cache_name,
+        lambda s: f"{FANOUT_PROMPTS[step_name]}\n\nContext:\n{s}\n\nItem:\n{item_json}",
+        FANOUT_CONFIGS.get(step_name),
+    )
+    try:
+        return response.text
+    except Exception:
+        return "Error: No valid response."
+
+def _extract_json(text):
+    """Pull the first JSON object out of an LLM response, or None.
+
+    JSON-mode responses are valid documents, so try a direct parse first —
+    the brace scanner below counts braces inside string literals too, and
+    would mis-slice valid output whose text values contain an unbalanced
+    brace. The scanner only handles the legacy prose-wrapped case; a single
+    forward scan with a depth counter is O(n) and cannot backtrack, unlike
+    the greedy `\\{.*\\}` regex it replaced, which could go super-linear on
+    long malformed output.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    for i in range(start, len(text)):
+        char = text[i]
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                try:
+                    return json.loads(text[start:i + 1])
+                except json.JSONDecodeError:
+                    return None
+    return None
+
+def fan_out_step(step_name, story, conversation, cache_name=None):
+    """Generate a fan-out step by dispatching one Gemini call per item concurrently.
+
+    Returns the merged JSON response text, or None if the source items could
+    not be parsed (the caller then falls back to the single-prompt path).
+    """
+    source_step, items_key, merge_key = FANOUT_SOURCES[step_name]
+    source = next((c.response for c in conversation if c.step == source_step), None)
+    if source is None:
+        return None
+    parsed_source = _extract_json(source)
+    items = parsed_source.get(items_key) if isinstance(parsed_source, dict) else None
+    if not items:
+        return None
+
+    payloads = [json.dumps(item, sort_keys=True) for item in items]
+    with ThreadPoolExecutor(max_workers=min(8, len(payloads))) as executor:
+        texts = list(executor.map(lambda p: generate_item(step_name, story, p, cache_name), payloads))
+
+    results = []
+    for text in texts:
+        obj = _extract_json(text)
+        if obj is None:
+            return None
+        results.append(obj)
+    return json.dumps({merge_key: results}, indent=2)
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=64)
+def _cached_canvas_completion(story: str, swot_json: str, partial_json: str, cache_name: str = None) -> str:
+    """Ask Gemini to fill only the canvas keys the selection does not decide."""
+    def build_prompt(context):
+        return (
+            "Complete a Business Model Canvas for the value proposition below. "
+            "The PARTIAL_CANVAS entries are already decided — repeat them "
+            "unchanged and fill in every other canvas key, grounded in the SWOT "
+            "entry and the story.\n\n"
+            f"SWOT entry:\n{swot_json}\n\nPARTIAL_CANVAS:\n{partial_json}\n\nContext:\n{context}"
+        )
+
+    response = _generate_with_story(story, cache_name, build_prompt, _CANVAS_CONFIG)
+    try:
+        return response.text
+    except Exception:
+        return "Error: No valid response."
+
+def generate_canvas_from_swot(story: str, selected_vp: dict, cache_name: str = None):
+    """BMC step specialized to one selected SWOT entry.
+
+    The blocks the selection already determines are filled deterministically
+    client-side (value_propositions = [title]); Gemini only completes the
+    rest against a canvas-only schema, so the prompt and output are both
+    smaller than the full-step call. Returns the standard {"bmc": [...]}
+    envelope, or None if the completion is unusable (caller falls back).
+    """
+    title = selected_vp.get("title", "Selected Value Proposition")
+    partial = {"value_propositions": [title]}
+    text = _cached_canvas_completion(
+        story, json.dumps(selected_vp, sort_keys=True), json.dumps(partial, sort_keys=True), cache_name
+    )
+    generated = _extract_json(text)
+    if not isinstance(generated, dict):
+        return None
+    canvas = {**generated, **partial}
+    return json.dumps({"bmc": [{"value_proposition": title, "canvas": canvas}]}, indent=2)
+
+@st.cache_data(show_spinner=False, ttl=24*60*60, max_entries=32)
+def _cached_pipeline(story: str, cache_name: str = None) -> str:
+    """One fused Gemini call producing every structured stage at once."""
+    response = _generate_with_story(
+        story, cache_name, lambda s: f"{PIPELINE_PROMPT}\n\nContext:\n{s}", PIPELINE_CONFIG
+    )
+    try:
+        return response.text
+    except Exception:
+        return "Error: No valid response."
+
+def run_full_pipeline(story: str, cache_name: str = None):
+    """Run every structured step in a single multi-output request.
+
+    Returns [(step_name, response_text), ...] in workflow order, or None if
+    the combined JSON is unusable — the caller then falls back to the normal
+    step-by-step path.
+    """
+    data = _extract_json(_cached_pipeline(story, cache_name))
+    if not isinstance(data, dict):
+        return None
+    results = []
+    for step, key in PIPELINE_STEP_KEYS.items():
+        if key not in data:
+            return None
+        results.append((step, json.dumps({key: data[key]}, indent=2)))
+    return results
@@ -0,0 +1,78 @@
+# session_store.py
+# SQLite-backed persistence for the workflow session, keyed by the "sid"
+# query parameter. A page reload or server restart restores the conversation
+# instantly instead of re-paying every Gemini call.
+import pickle
+import sqlite3
+import uuid
+import streamlit as st
+
+_DB_PATH = "sessions.db"
+
+@st.cache_resource
+def _connection():
+    """One SQLite connection per process (Streamlit reruns share it)."""
+    conn = sqlite3.connect(_DB_PATH, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, blob BLOB)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS semantic_cache (step TEXT, context_key TEXT, vector BLOB, response TEXT)"
+    )
+    try:
+        # Migrate rows written before the context_key column existed.
+        conn.execute("ALTER TABLE semantic_cache ADD COLUMN context_key TEXT DEFAULT ''")
+    except sqlite3.OperationalError:
+        pass
+    conn.commit()
+    return conn
+
+def current_sid() -> str:
+    """Session id from the URL, minting (and writing back) one if missing."""
+    sid = st.query_params.get("sid")
+    if not sid:
+        sid = uuid.uuid4().hex
+        st.query_params["sid"] = sid
+    return sid
+
+def load_session(sid: str):
+    """Return the saved state dict for sid, or None if absent/unreadable."""
+    row = _connection().execute("SELECT blob FROM sessions WHERE sid=?", (sid,)).fetchone()
+    if row is None:
+        return None
+    try:
+        return pickle.loads(row[0])
+    except Exception:
+        return None
+
+def save_session(sid: str, state: dict):
+    """Upsert the pickled state dict for sid."""
+    conn = _connection()
+    conn.execute(
+        "INSERT INTO sessions(sid, blob) VALUES(?, ?) "
+        "ON CONFLICT(sid) DO UPDATE SET blob=excluded.blob",
+        (sid, pickle.dumps(state)),
+    )
+    conn.commit()
+
+def load_semantic_rows(step: str, context_key: str):
+    """Return the (embedding vector, response) rows for a step whose
+    non-story inputs hashed to context_key."""
+    rows = _connection().execute(
+        "SELECT vector, response FROM semantic_cache WHERE step=? AND context_key=?",
+        (step, context_key),
+    ).fetchall()
+    out = []
+    for blob, response in rows:
+        try:
+            out.append((pickle.loads(blob), response))
+        except Exception:
+            continue
+    return out
+
+def add_semantic_row(step: str, context_key: str, vector, response: str):
+    """Append one (step, context key, embedding vector, response) row."""
+    conn = _connection()
+    conn.execute(
+        "INSERT INTO semantic_cache(step, context_key, vector, response) VALUES(?, ?, ?, ?)",
+        (step, context_key, pickle.dumps(vector), response),
+    )
+    conn.commit()
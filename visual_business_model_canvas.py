@@ -1,36 +1,130 @@
 # visual_business_model_canvas.py
 import streamlit as st
-import json, re
+import io, json, re
+from html import escape
+
+# Prefer a C/Rust JSON parser when one is around: orjson (2–3x faster than
+# stdlib on typical nested dicts), else pydantic_core's SIMD-accelerated
+# from_json (ships with pydantic), else stdlib json. All decode errors are
+# ValueError subclasses so the except clauses stay compatible.
+try:
+    import orjson
+    _loads = orjson.loads
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    try:
+        from pydantic_core import from_json as _loads
+        _JSONDecodeError = ValueError
+    except ImportError:
+        _loads = json.loads
+        _JSONDecodeError = json.JSONDecodeError
+
+_SPLIT_RE = re.compile(r"[\n,;]")
 
 def listify(value):
     """Convert string or list into a clean list."""
     if isinstance(value, list):
         return value
     elif isinstance(value, str):
-        return [v.strip("-• ") for v in re.split(r"[\n,;]", value) if v.strip()]
+        return [v.strip("-• ") for v in _SPLIT_RE.split(value) if v.strip()]
     return []
 
-def render_bullets(items):
-    """Render a list of items as bullet points in Streamlit."""
+# Shared card styling emitted once per page instead of inlining the same CSS
+# into every block — the per-card HTML shrinks to a class name.
+_BMC_CSS = """<style>
+.bmc-grid{display:grid;grid-template-columns:repeat(3,1fr);gap:8px;}
+.bmc-block{border-radius:10px;padding:10px;}
+.bmc-block ul{margin-top:6px;}
+.bmc-blue{background-color:#e6f7ff;}
+.bmc-amber{background-color:#fff8e6;}
+.bmc-green{background-color:#e6ffe6;}
+.bmc-red{background-color:#ffe6e6;}
+.bmc-sky{background-color:#f0f8ff;}
+.bmc-rose{background-color:#fff0f0;}
+</style>"""
+
+# Canvas blocks in row-major grid order (3 columns), mirroring the classic
+# BMC layout: partners/VP/segments, activities/relationships/revenue,
+# resources/channels/costs.
+_BLOCKS = [
+    ("key_partners", "🤝 Key Partners", "bmc-blue"),
+    ("value_propositions", "🎁 Value Propositions", "bmc-amber"),
+    ("customer_segments", "👥 Customer Segments", "bmc-green"),
+    ("key_activities", "⚙️ Key Activities", "bmc-red"),
+    ("customer_relationships", "💬 Customer Relationships", "bmc-sky"),
+    ("revenue_streams", "💰 Revenue Streams", "bmc-amber"),
+    ("key_resources", "🧰 Key Resources", "bmc-green"),
+    ("channels", "🚚 Channels", "bmc-rose"),
+    ("cost_structure", "🧾 Cost Structure", "bmc-red"),
+]
+
+def _block_html(title, items, css_class):
+    """Build the HTML for one canvas block."""
     items = listify(items)
-    if items:
-        st.markdown("• " + "\n• ".join(items))
-    else:
-        st.markdown("—")  # display dash if empty
+    bullets = "".join(f"<li>{escape(item)}</li>" for item in items) if items else "<li>—</li>"
+    return f'<div class="bmc-block {css_class}"><h5>{title}</h5><ul>{bullets}</ul></div>'
+
+def build_canvas_html(canvas):
+    """Build the whole 9-block canvas as a single CSS-grid HTML string."""
+    cards = "".join(_block_html(title, canvas.get(key, []), css_class) for key, title, css_class in _BLOCKS)
+    return f'<div class="bmc-grid">{cards}</div>'
+
+@st.cache_data(show_spinner=False)
+def canvas_txt(vp_title: str, canvas_json: str) -> str:
+    """Plain-text export of one canvas, written straight into a StringIO and
+    cached per (title, canvas) so the download bytes survive reruns."""
+    canvas = _loads(canvas_json)
+    buf = io.StringIO()
+    buf.write(f"# {vp_title}\n\n")
+    for key, title, _ in _BLOCKS:
+        buf.write(f"## {title}\n")
+        items = listify(canvas.get(key, []))
+        if items:
+            buf.writelines(f"- {item}\n" for item in items)
+        else:
+            buf.write("- —\n")
+        buf.write("\n")
+    return buf.getvalue()
+
+@st.cache_data(show_spinner=False)
+def _parse_bmc_json(text: str):
+    """Parse the BMC response once per unique text (reruns hit the memo).
+
+    Gemini JSON mode returns pure JSON, so parse directly; fall back to
+    slicing out the outermost {...} with two C-level scans for legacy
+    prose-wrapped responses. Returns None when no JSON can be recovered.
+    """
+    try:
+        return _loads(text)
+    except _JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            return None
+        try:
+            return _loads(text[start:end + 1])
+        except _JSONDecodeError:
+            return None
+
+@st.cache_data(show_spinner=False)
+def render_vp_html(vp_title: str, canvas_json: str) -> str:
+    """Memoized canvas HTML per (title, canvas) — reruns that don't change the
+    response (e.g. feedback keystrokes) skip listify and string building."""
+    return build_canvas_html(_loads(canvas_json))
 
 def show_bmc_visualization(response_text):
     st.markdown("---")
     st.subheader("🏗️ Business Model Canvas Visualization")
+    # One shared style block per render; the cards themselves carry only
+    # class names. (Reruns rebuild the page, so this cannot be gated on
+    # session state without losing the styling.)
+    st.markdown(_BMC_CSS, unsafe_allow_html=True)
 
-    # Extract JSON from text
-    match = re.search(r"(\{(?:.|\n)*\})", response_text)
-    json_str = match.group(1) if match else None
-    if not json_str:
+    data = _parse_bmc_json(response_text)
+    if data is None:
         st.warning("⚠️ No valid JSON found in BMC output.")
         return
 
     try:
-        data = json.loads(json_str)
         if "bmc" not in data or not data["bmc"]:
             st.info("No BMC entries found in JSON.")
             return
@@ -42,58 +136,22 @@ def show_bmc_visualization(response_text):
         entry = data["bmc"][selected_idx]
         canvas = entry.get("canvas", {})
 
-        st.markdown(f"## 💡 {entry.get('value_proposition', 'Untitled Value Proposition')}")
-
-        # Layout: 3 columns
-        col1, col2, col3 = st.columns(3)
-
-        with col1:
-            st.markdown(
-                '<div style="background-color:#e6f7ff;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>🤝 Key Partners</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("key_partners", []))
-
-            st.markdown(
-                '<div style="background-color:#ffe6e6;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>⚙️ Key Activities</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("key_activities", []))
-
-            st.markdown(
-                '<div style="background-color:#e6ffe6;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>🧰 Key Resources</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("key_resources", []))
-
-        with col2:
-            st.markdown(
-                '<div style="background-color:#fff8e6;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>🎁 Value Propositions</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("value_propositions", []))
-
-            st.markdown(
-                '<div style="background-color:#f0f8ff;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>💬 Customer Relationships</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("customer_relationships", []))
-
-            st.markdown(
-                '<div style="background-color:#fff0f0;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>🚚 Channels</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("channels", []))
-
-        with col3:
-            st.markdown(
-                '<div style="background-color:#e6ffe6;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>👥 Customer Segments</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("customer_segments", []))
-
-            st.markdown(
-                '<div style="background-color:#fff8e6;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>💰 Revenue Streams</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("revenue_streams", []))
-
-            st.markdown(
-                '<div style="background-color:#ffe6e6;border-radius:10px;padding:10px;margin-bottom:8px;">'
-                '<h5>🧾 Cost Structure</h5></div>', unsafe_allow_html=True)
-            render_bullets(canvas.get("cost_structure", []))
+        vp_title = entry.get('value_proposition', 'Untitled Value Proposition')
+        st.markdown(f"## 💡 {vp_title}")
+
+        # One markdown call for the whole canvas instead of nine — Streamlit's
+        # render cost is per-call, so this collapses nine deltas into one.
+        st.markdown(
+            render_vp_html(vp_title, json.dumps(canvas, sort_keys=True)),
+            unsafe_allow_html=True,
+        )
+
+        st.download_button(
+            "⬇️ Download Canvas (.txt)",
+            data=canvas_txt(vp_title, json.dumps(canvas, sort_keys=True)),
+            file_name="Business_Model_Canvas.txt",
+            mime="text/plain",
+        )
 
         st.markdown("---")
 